@@ -7,8 +7,8 @@ from collections import namedtuple
 from math import ceil
 
 COMMANDS = namedtuple('COMMANDS', ['EMPTY', 'WRITE', 'READ', 'POSITION',
-                                   'START', 'STOP'],
-                      defaults=range(6))()
+                                   'START', 'STOP', 'WRITE_BURST'],
+                      defaults=range(7))()
 INSTRUCTIONS = namedtuple('INSTRUCTIONS', ['MOVE', 'WRITEPIN', 'SCANLINE',
                           'LASTSCANLINE'],
                           defaults=range(1, 5))()
@@ -21,6 +21,7 @@ STATE = namedtuple('STATE', ['FULL', 'PARSING', 'ERROR'],
 COMMAND_BYTES = 1
 WORD_BYTES = 8
 MEMWIDTH = WORD_BYTES*8
+FULL_THRESH = 2  # FIFO is full if less words are available
 FREQ = 1E6  # motor move interpolation freq in Hz
 MOVE_INSTRUCTION = {'INSTRUCTION': 1, 'TICKS': 7}
 DEGREE = 3  # only third degree polynomal
@@ -316,7 +316,7 @@ class Host:
         return int(bits[STATE.FULL])
 
     def send_command(self, data, format='!Q'):
-        assert len(data) == WORD_BYTES+COMMAND_BYTES
+        assert (len(data)-COMMAND_BYTES) % WORD_BYTES == 0
         if self.generator:
             data = (yield from self.spi_exchange_data(data))
         else:
@@ -341,36 +341,48 @@ class Host:
                 + [INSTRUCTIONS.WRITEPIN])
         yield from self.send_command(data)
 
-    def send_move(self, ticks, a, b, c, maxtrials=1E5):
+    def send_move(self, ticks, a, b, c, maxtrials=1E5, burst=True):
         '''send move instruction with data
 
         data            -- coefficients for polynomal move
         maxtrials       -- max number of communcation trials
+        burst           -- send all words in one transaction, memory is
+                           reported full if the move does not fit
 
         returns array with status home switches
         Zero implies home switch is hit
         '''
         if self.generator:
             maxtrials = 10
-        commands = self.move_commands(ticks, a, b, c)
+        commands = self.move_commands(ticks, a, b, c, burst)
         # TODO: this has been changed, remove if passes checks on machine
         for command in commands:
             trials = 0
             while True:
                 data_out = (yield from self.send_command(command))
                 trials += 1
-                bits = [int(i) for i in "{:08b}".format(data_out[-1])]
-                if int(bits[STATE.ERROR]):
-                    raise Exception("Error detected on FPGA")
-                bits = [int(i) for i in "{:08b}".format(data_out[-2])]
-                home_bits = np.array(bits[:self.platform.motors])
-                if not (yield from self.memfull(data_out)):
+                # reply to command, burst is accepted or rejected as whole
+                reply = data_out[:COMMAND_BYTES+WORD_BYTES]
+                if not (yield from self.memfull(reply)):
+                    home_bits = self.check_reply(data_out)
                     break
+                self.check_reply(reply)
                 if trials > maxtrials:
                     raise Memfull(f"Too many trials {trials} needed")
         return home_bits
 
-    def move_commands(self, ticks, a, b, c):
+    def check_reply(self, data_out):
+        '''raises exception if error is reported in reply
+
+        returns array with status home switches
+        '''
+        bits = [int(i) for i in "{:08b}".format(data_out[-1])]
+        if int(bits[STATE.ERROR]):
+            raise Exception("Error detected on FPGA")
+        bits = [int(i) for i in "{:08b}".format(data_out[-2])]
+        return np.array(bits[:self.platform.motors])
+
+    def move_commands(self, ticks, a, b, c, burst=True):
         '''get list of commands for move instruction with
            [a,b,c] for ax+bx^2+cx^3
 
@@ -378,23 +390,27 @@ class Host:
            speed        -- speed in mm/s
            acceleration -- acceleration in mm/s2
            postion      -- list with position in mm
+           burst        -- single command with all words of move
         '''
         assert len(ticks) == 1
         assert len(a) == len(b) == len(c) == self.platform.motors
-        write_byte = COMMANDS.WRITE.to_bytes(1, 'big')
+        if burst:
+            write_byte = COMMANDS.WRITE_BURST.to_bytes(1, 'big')
+        else:
+            write_byte = COMMANDS.WRITE.to_bytes(1, 'big')
         move_byte = INSTRUCTIONS.MOVE.to_bytes(1, 'big')
-        commands = []
-        commands += [write_byte +
-                     ticks[0].to_bytes(7, 'big') + move_byte]
+        words = [ticks[0].to_bytes(7, 'big') + move_byte]
         for motor in range(self.platform.motors):
-            commands += [write_byte + a[motor].to_bytes(8, 'big', signed=True)]
-            commands += [write_byte + b[motor].to_bytes(8, 'big', signed=True)]
-            commands += [write_byte + c[motor].to_bytes(8, 'big', signed=True)]
-        return commands
+            words += [a[motor].to_bytes(8, 'big', signed=True)]
+            words += [b[motor].to_bytes(8, 'big', signed=True)]
+            words += [c[motor].to_bytes(8, 'big', signed=True)]
+        if burst:
+            return [write_byte + b''.join(words)]
+        return [write_byte + word for word in words]
 
     def spi_exchange_data(self, data):
         '''writes data to peripheral, returns reply'''
-        assert len(data) == (COMMAND_BYTES + WORD_BYTES)
+        assert (len(data)-COMMAND_BYTES) % WORD_BYTES == 0
         self.chip_select.off()
         # spidev changes values passed to it
         datachanged = deepcopy(data)
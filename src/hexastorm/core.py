@@ -4,9 +4,11 @@ from copy import deepcopy
 
 import numpy as np
 from numpy.testing import assert_array_equal
-from nmigen import Signal, Elaboratable, signed, Cat
-from nmigen import Module
-from nmigen.hdl.mem import Array
+from nmigen import Signal, Elaboratable, Cat, Mux
+from nmigen import Module, DomainRenamer
+from nmigen.hdl.mem import Memory
+from nmigen.lib.cdc import FFSynchronizer
+from nmigen.lib.fifo import AsyncFIFO
 from luna.gateware.utils.cdc import synchronize
 from luna.gateware.interface.spi import SPICommandInterface, SPIBus
 from luna.gateware.memory import TransactionalizedFIFO
@@ -20,8 +22,255 @@ from hexastorm.resources import get_all_resources
 from hexastorm.lasers import Laserhead, DiodeSimulator, params
 from hexastorm.constants import (COMMAND_BYTES, WORD_BYTES, STATE,
                                  INSTRUCTIONS, MEMWIDTH, COMMANDS,
-                                 DEGREE, FREQ, wordsinscanline,
-                                 wordsinmove)
+                                 DEGREE, FREQ, FULL_THRESH,
+                                 wordsinscanline, wordsinmove)
+
+
+class FifoWriter(Elaboratable):
+    """ Writes words received over SPI to transactionalized FIFO
+
+    A word is accepted if the writer is ready and held in a skid
+    register till it is written. The first word of an
+    instruction is validated. Writes are committed in groups of
+    platform.commit_every instructions. A partial group is committed
+    platform.commit_wait cycles after its first instruction is
+    completed, i.e. the wait is a deadline and not an idle timeout.
+    A valid discard drops the partially received instruction, written
+    words are discarded from the FIFO.
+
+    I/O signals:
+        I: valid          -- word or discard is valid
+        I: word           -- word received over SPI
+        I: discard        -- transaction was aborted, drop instruction
+        O: ready          -- word can be accepted, skid register is empty
+        O: full           -- FIFO is full
+        O: error          -- received instruction is invalid
+    """
+    def __init__(self, platform, fifo):
+        """
+        platform  -- pass test platform
+        fifo      -- transactionalizedfifo written to
+        """
+        self.platform = platform
+        self.fifo = fifo
+
+        self.valid = Signal()
+        self.word = Signal(MEMWIDTH)
+        self.discard = Signal()
+        self.ready = Signal()
+        self.full = Signal()
+        self.error = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        platform = self.platform
+        fifo = self.fifo
+        # word waiting to be written
+        skid = Signal(MEMWIDTH)
+        skid_discard = Signal()
+        skid_valid = Signal()
+        m.d.comb += self.ready.eq(~skid_valid)
+        with m.If(self.valid & self.ready):
+            m.d.sync += [skid.eq(self.word), skid_discard.eq(self.discard),
+                         skid_valid.eq(1)]
+        wordsreceived = Signal(range(wordsinmove(platform.motors)+1))
+        # remember which instruction we are processing
+        instruction = Signal(8)
+        # instructions written but not yet committed
+        pending = Signal(range(platform.commit_every))
+        timer = Signal(range(platform.commit_wait+1))
+        with m.If((pending != 0) & (timer != platform.commit_wait)):
+            m.d.sync += timer.eq(timer+1)
+        # flag is registered to keep compare out of the handshake
+        full = Signal()
+        m.d.sync += full.eq(fifo.space_available < FULL_THRESH)
+        m.d.comb += self.full.eq(full)
+        with m.FSM(reset='WAIT_WORD', name='writer'):
+            with m.State('WAIT_WORD'):
+                with m.If(skid_valid & skid_discard):
+                    m.d.sync += [skid_valid.eq(0), wordsreceived.eq(0)]
+                    with m.If(wordsreceived != 0):
+                        m.d.sync += [pending.eq(0),
+                                     timer.eq(0),
+                                     fifo.write_discard.eq(1)]
+                        # uncommitted instructions are dropped as well
+                        with m.If(pending != 0):
+                            m.d.sync += self.error.eq(1)
+                        m.next = 'DISCARD'
+                with m.Elif(skid_valid & ~full):
+                    m.d.sync += skid_valid.eq(0)
+                    byte0 = skid[:8]
+                    with m.If(wordsreceived == 0):
+                        with m.If((byte0 > 0) & (byte0 < 6)):
+                            m.d.sync += [instruction.eq(byte0),
+                                         fifo.write_en.eq(1),
+                                         wordsreceived.eq(wordsreceived+1),
+                                         fifo.write_data.eq(skid)]
+                            m.next = 'WRITE'
+                        with m.Else():
+                            m.d.sync += self.error.eq(1)
+                    with m.Else():
+                        m.d.sync += [fifo.write_en.eq(1),
+                                     wordsreceived.eq(wordsreceived+1),
+                                     fifo.write_data.eq(skid)]
+                        m.next = 'WRITE'
+                # commit partial group, instructions are never split
+                with m.Elif((pending != 0) & (wordsreceived == 0) &
+                            (timer == platform.commit_wait)):
+                    m.d.sync += [pending.eq(0),
+                                 timer.eq(0),
+                                 fifo.write_commit.eq(1)]
+                    m.next = 'COMMIT'
+            with m.State('WRITE'):
+                m.d.sync += fifo.write_en.eq(0)
+                wordslaser = wordsinscanline(
+                    params(platform)['BITSINSCANLINE'])
+                wordsmotor = wordsinmove(platform.motors)
+                with m.If(((instruction == INSTRUCTIONS.MOVE) &
+                          (wordsreceived >= wordsmotor))
+                          | (instruction == INSTRUCTIONS.WRITEPIN)
+                          | (instruction == INSTRUCTIONS.LASTSCANLINE)
+                          | ((instruction == INSTRUCTIONS.SCANLINE) &
+                          (wordsreceived >= wordslaser)
+                          )):
+                    m.d.sync += wordsreceived.eq(0)
+                    with m.If(pending == platform.commit_every-1):
+                        m.d.sync += [pending.eq(0),
+                                     timer.eq(0),
+                                     fifo.write_commit.eq(1)]
+                        m.next = 'COMMIT'
+                    with m.Else():
+                        m.d.sync += pending.eq(pending+1)
+                        m.next = 'WAIT_WORD'
+                with m.Else():
+                    m.next = 'WAIT_WORD'
+            with m.State('COMMIT'):
+                m.d.sync += fifo.write_commit.eq(0)
+                m.next = 'WAIT_WORD'
+            with m.State('DISCARD'):
+                m.d.sync += fifo.write_discard.eq(0)
+                m.next = 'WAIT_WORD'
+        return m
+
+
+class SPIBurstInterface(SPICommandInterface):
+    """ SPI command interface which can exchange multiple words
+
+    Variant of the luna SPICommandInterface. If burst is high at the
+    end of a word, the interface latches word_to_send and exchanges
+    the next word in the same transaction, else it stalls till
+    chip select is deasserted.
+
+    I/O signals:
+        I: burst          -- exchange another word after current word
+        other signals are described in SPICommandInterface
+    """
+    def __init__(self, command_size=8, word_size=32):
+        super().__init__(command_size=command_size, word_size=word_size)
+        self.burst = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        spi = self.spi
+        # sample on falling edge of SPI clock
+        past_sck = Signal()
+        m.d.sync += past_sck.eq(spi.sck)
+        sample_edge = past_sck & ~spi.sck
+        bit_count = Signal(range(max(self.word_size, self.command_size)+1))
+        current_command = Signal.like(self.command)
+        current_word = Signal.like(self.word_received)
+        m.d.sync += [self.command_ready.eq(0),
+                     self.word_complete.eq(0)]
+        with m.FSM() as fsm:
+            m.d.comb += [self.idle.eq(fsm.ongoing('IDLE')),
+                         self.stalled.eq(fsm.ongoing('STALL'))]
+            with m.State('STALL'):
+                with m.If(~spi.cs):
+                    m.next = 'IDLE'
+            with m.State('IDLE'):
+                m.d.sync += bit_count.eq(0)
+                with m.If(spi.cs):
+                    m.next = 'RECEIVE_COMMAND'
+            with m.State('RECEIVE_COMMAND'):
+                with m.If(~spi.cs):
+                    m.next = 'IDLE'
+                with m.If(bit_count < self.command_size):
+                    with m.If(sample_edge):
+                        m.d.sync += [bit_count.eq(bit_count + 1),
+                                     current_command.eq(
+                                     Cat(spi.sdi, current_command[:-1]))]
+                with m.Else():
+                    m.d.sync += [bit_count.eq(0),
+                                 self.command_ready.eq(1),
+                                 self.command.eq(current_command)]
+                    m.next = 'PROCESSING'
+            # controller prepares word_to_send
+            with m.State('PROCESSING'):
+                m.next = 'LATCH_OUTPUT'
+            with m.State('LATCH_OUTPUT'):
+                m.d.sync += current_word.eq(self.word_to_send)
+                m.next = 'SHIFT_DATA'
+            with m.State('SHIFT_DATA'):
+                with m.If(~spi.cs):
+                    m.next = 'IDLE'
+                m.d.sync += spi.sdo.eq(current_word[-1])
+                with m.If(bit_count < self.word_size):
+                    with m.If(sample_edge):
+                        m.d.sync += [bit_count.eq(bit_count + 1),
+                                     current_word.eq(
+                                     Cat(spi.sdi, current_word[:-1]))]
+                with m.Else():
+                    m.d.sync += [bit_count.eq(0),
+                                 self.word_complete.eq(1),
+                                 self.word_received.eq(current_word)]
+                    with m.If(self.burst):
+                        m.next = 'PROCESSING'
+                    with m.Else():
+                        m.next = 'STALL'
+        return m
+
+
+class BusSynchronizer(Elaboratable):
+    """ Transfers a bus to another clock domain
+
+    The bus is captured in a hold register and a request is toggled.
+    Once the request arrives in the output domain, the hold register
+    is copied and the request is acknowledged. The hold register
+    only changes after the acknowledge is received, so bits can not
+    tear. Single bits pass through FFSynchronizers.
+
+    I/O signals:
+        I: i              -- bus in input domain
+        O: o              -- bus in output domain
+    """
+    def __init__(self, width, i_domain='sync', o_domain='sync'):
+        """
+        width     -- width of the bus
+        i_domain  -- clock domain of the input
+        o_domain  -- clock domain of the output
+        """
+        self.i_domain = i_domain
+        self.o_domain = o_domain
+        self.i = Signal(width)
+        self.o = Signal(width)
+
+    def elaborate(self, platform):
+        m = Module()
+        hold = Signal.like(self.i)
+        req = Signal()
+        ack = Signal()
+        # request and acknowledge in the other domain
+        req_o = Signal()
+        ack_i = Signal()
+        m.submodules.req_cdc = FFSynchronizer(req, req_o,
+                                              o_domain=self.o_domain)
+        m.submodules.ack_cdc = FFSynchronizer(ack, ack_i,
+                                              o_domain=self.i_domain)
+        with m.If(req == ack_i):
+            m.d[self.i_domain] += [hold.eq(self.i), req.eq(~req)]
+        with m.If(req_o != ack):
+            m.d[self.o_domain] += [self.o.eq(hold), ack.eq(req_o)]
+        return m
 
 
 class SPIParser(Elaboratable):
@@ -32,6 +281,18 @@ class SPIParser(Elaboratable):
       start  -- enable execution of gcode
       stop   -- halt execution of gcode
       write  -- write instruction to FIFO or report memory is full
+      write burst -- write all words of a move in one transaction,
+                     the move is only accepted if it fits completely
+
+    Commands are decoded by the parser, received words are
+    handed over to the FIFO writer. The parser can accept a new
+    command while the word is written.
+    The spi interface and parser can run in a separate clock domain,
+    words then cross to the FIFO writer via an asynchronous FIFO.
+    State, position and the motor counter cross via bus synchronizers.
+    Chip select has to be low for at least four cycles of the spi
+    domain between transactions, the interface samples it after a
+    synchronizer and has to return to idle before the next command.
 
     I/O signals:
         I/O: Spibus       -- spi bus connected to peripheral
@@ -45,17 +306,18 @@ class SPIParser(Elaboratable):
         O: read_data      -- read data from transactionalizedfifo
         O: empty          -- transactionalizedfifo is empty
     """
-    def __init__(self, platform, top=False):
+    def __init__(self, platform, top=False, domain='sync'):
         """
         platform  -- pass test platform
         top       -- trigger synthesis of module
+        domain    -- clock domain of spi interface and parser
         """
         self.platform = platform
         self.top = top
+        self.domain = domain
 
         self.spi = SPIBus()
-        self.position = Array(Signal(signed(64))
-                              for _ in range(platform.motors))
+        self.position = Memory(width=64, depth=platform.motors)
         self.pinstate = Signal(8)
         self.read_commit = Signal()
         self.read_en = Signal()
@@ -69,15 +331,10 @@ class SPIParser(Elaboratable):
         m = Module()
         if platform and self.top:
             board_spi = platform.request("debug_spi")
-            spi2 = synchronize(m, board_spi)
+            spi2 = synchronize(m, board_spi, o_domain=self.domain)
             m.d.comb += self.spi.connect(spi2)
         if self.platform:
             platform = self.platform
-        spi = self.spi
-        interf = SPICommandInterface(command_size=COMMAND_BYTES*8,
-                                     word_size=WORD_BYTES*8)
-        m.d.comb += interf.spi.connect(spi)
-        m.submodules.interf = interf
         # FIFO connection
         fifo = TransactionalizedFIFO(width=MEMWIDTH,
                                      depth=platform.memdepth)
@@ -89,91 +346,158 @@ class SPIParser(Elaboratable):
                      fifo.read_discard.eq(self.read_discard),
                      fifo.read_en.eq(self.read_en),
                      self.empty.eq(fifo.empty)]
-        # Parser
-        mtrcntr = Signal(range(platform.motors))
-        wordsreceived = Signal(range(wordsinmove(platform.motors)+1))
-        error = Signal()
+        # FIFO writer
+        writer = FifoWriter(platform, fifo)
+        m.submodules.writer = writer
         # Peripheral state
         state = Signal(8)
+        # word received by parser was not accepted
+        lost = Signal()
         m.d.sync += [state[STATE.PARSING].eq(self.execute),
-                     state[STATE.FULL].eq(fifo.space_available <= 1),
-                     state[STATE.ERROR].eq(self.dispatcherror | error)]
-        # remember which word we are processing
-        instruction = Signal(8)
-        with m.FSM(reset='RESET', name='parser'):
-            with m.State('RESET'):
-                m.d.sync += [self.execute.eq(1), wordsreceived.eq(0),
-                             error.eq(0)]
-                m.next = 'WAIT_COMMAND'
-            with m.State('WAIT_COMMAND'):
-                with m.If(interf.command_ready):
-                    word = Cat(state[::-1], self.pinstate[::-1])
-                    with m.If(interf.command == COMMANDS.EMPTY):
-                        m.next = 'WAIT_COMMAND'
-                    with m.Elif(interf.command == COMMANDS.START):
-                        m.next = 'WAIT_COMMAND'
-                        m.d.sync += self.execute.eq(1)
-                    with m.Elif(interf.command == COMMANDS.STOP):
-                        m.next = 'WAIT_COMMAND'
-                        m.d.sync += self.execute.eq(0)
-                    with m.Elif(interf.command == COMMANDS.WRITE):
-                        m.d.sync += interf.word_to_send.eq(word)
-                        with m.If(state[STATE.FULL] == 0):
-                            m.next = 'WAIT_WORD'
-                        with m.Else():
-                            m.next = 'WAIT_COMMAND'
-                    with m.Elif(interf.command == COMMANDS.READ):
-                        m.d.sync += interf.word_to_send.eq(word)
-                        m.next = 'WAIT_COMMAND'
-                    with m.Elif(interf.command == COMMANDS.POSITION):
+                     state[STATE.FULL].eq(writer.full),
+                     state[STATE.ERROR].eq(self.dispatcherror | writer.error
+                                           | lost)]
+        # reply with state and pin state, bit order is reversed
+        status_word = Signal(16)
+        m.d.sync += status_word.eq(Cat(state[::-1], self.pinstate[::-1]))
+        full_bit = len(state)-1-STATE.FULL
+        # space for all words of a move is reserved by
+        # the first word of a burst
+        words_burst = wordsinmove(platform.motors)
+        room = Signal()
+        m.d.sync += room.eq(fifo.space_available >=
+                            words_burst+FULL_THRESH-1)
+        # Parser, runs in the spi domain
+        parser = Module()
+        interf = SPIBurstInterface(command_size=COMMAND_BYTES*8,
+                                   word_size=WORD_BYTES*8)
+        parser.d.comb += interf.spi.connect(self.spi)
+        parser.submodules.interf = interf
+        mtrcntr = Signal(range(platform.motors))
+        # position is read in the sync domain
+        position = self.position.read_port(transparent=False)
+        m.submodules.position = position
+        # signals crossing to the spi domain
+        status = Signal.like(status_word)
+        burst_room = Signal()
+        position_data = Signal.like(position.data)
+        # word is received, word can not be accepted
+        word_valid = Signal()
+        word_full = Signal()
+        execute = Signal()
+        # transaction ended before word is received, passed to
+        #   the writer in order with the words
+        abort = Signal()
+        if self.domain == 'sync':
+            m.d.comb += [status.eq(status_word),
+                         burst_room.eq(room),
+                         position_data.eq(position.data),
+                         position.addr.eq(mtrcntr),
+                         writer.word.eq(interf.word_received),
+                         writer.discard.eq(abort),
+                         writer.valid.eq(word_valid | abort),
+                         self.execute.eq(execute)]
+            with m.If((word_valid | abort) & ~writer.ready):
+                m.d.sync += lost.eq(1)
+        else:
+            to_spi = BusSynchronizer(len(status)+1+len(position_data),
+                                     o_domain=self.domain)
+            m.submodules.to_spi = to_spi
+            m.d.comb += [to_spi.i.eq(Cat(status_word, room, position.data)),
+                         Cat(status, burst_room,
+                             position_data).eq(to_spi.o)]
+            from_spi = BusSynchronizer(len(mtrcntr)+1,
+                                       i_domain=self.domain)
+            m.submodules.from_spi = from_spi
+            m.d.comb += [from_spi.i.eq(Cat(mtrcntr, execute)),
+                         Cat(position.addr, self.execute).eq(from_spi.o)]
+            words = AsyncFIFO(width=MEMWIDTH+1, depth=4,
+                              r_domain='sync', w_domain=self.domain)
+            m.submodules.words = words
+            m.d.comb += [words.w_data.eq(Cat(interf.word_received, abort)),
+                         words.w_en.eq(word_valid | abort),
+                         word_full.eq(~words.w_rdy),
+                         writer.word.eq(words.r_data[:MEMWIDTH]),
+                         writer.discard.eq(words.r_data[MEMWIDTH]),
+                         writer.valid.eq(words.r_rdy),
+                         words.r_en.eq(writer.ready)]
+            lost_spi = Signal()
+            with m.If(words.w_en & ~words.w_rdy):
+                m.d[self.domain] += lost_spi.eq(1)
+            m.submodules.lost_cdc = FFSynchronizer(lost_spi, lost)
+        # words left in burst after current word
+        remaining = Signal(range(words_burst))
+        parser.d.comb += interf.burst.eq(remaining != 0)
+        # replies are registered in the domain of the spi interface
+        #   so only a select remains in front of the shifter, they are
+        #   only enabled if the peripheral is selected
+
+        def with_full(full_flag):
+            return Cat(status[:full_bit], full_flag | word_full,
+                       status[full_bit+1:])
+        status_reply = Signal.like(status)
+        burst_reply = Signal.like(status)
+        with parser.If(self.spi.cs):
+            parser.d.sync += [status_reply.eq(with_full(status[full_bit])),
+                              burst_reply.eq(with_full(~burst_room))]
+        # command and full state are registered
+        # before they are decoded
+        command = Signal.like(interf.command)
+        full = Signal()
+        with parser.FSM(reset='RESET', name='parser'):
+            with parser.State('RESET'):
+                parser.d.sync += execute.eq(1)
+                parser.next = 'WAIT_COMMAND'
+            with parser.State('WAIT_COMMAND'):
+                with parser.If(interf.command_ready):
+                    parser.d.sync += remaining.eq(0)
+                    # reply is latched by interface in next cycle
+                    is_position = interf.command == COMMANDS.POSITION
+                    is_burst = interf.command == COMMANDS.WRITE_BURST
+                    reply = Mux(is_burst, burst_reply, status_reply)
+                    parser.d.sync += [interf.word_to_send.eq(
+                                      Mux(is_position, position_data,
+                                          reply)),
+                                      command.eq(interf.command),
+                                      full.eq(reply[full_bit])]
+                    parser.next = 'DECODE'
+            with parser.State('DECODE'):
+                # empty and read only require a reply
+                parser.next = 'WAIT_COMMAND'
+                with parser.Switch(command):
+                    with parser.Case(COMMANDS.START):
+                        parser.d.sync += execute.eq(1)
+                    with parser.Case(COMMANDS.STOP):
+                        parser.d.sync += execute.eq(0)
+                    with parser.Case(COMMANDS.WRITE):
+                        with parser.If(full == 0):
+                            parser.next = 'WAIT_WORD'
+                    with parser.Case(COMMANDS.WRITE_BURST):
+                        with parser.If(full == 0):
+                            parser.d.sync += remaining.eq(words_burst-1)
+                            parser.next = 'WAIT_WORD'
+                    with parser.Case(COMMANDS.POSITION):
                         # position is requested multiple times for multiple
                         # motors
-                        with m.If(mtrcntr < platform.motors-1):
-                            m.d.sync += mtrcntr.eq(mtrcntr+1)
-                        with m.Else():
-                            m.d.sync += mtrcntr.eq(0)
-                        m.d.sync += interf.word_to_send.eq(
-                                                self.position[mtrcntr])
-                        m.next = 'WAIT_COMMAND'
-            with m.State('WAIT_WORD'):
-                with m.If(interf.word_complete):
-                    byte0 = interf.word_received[:8]
-                    with m.If(wordsreceived == 0):
-                        with m.If((byte0 > 0) & (byte0 < 6)):
-                            m.d.sync += [instruction.eq(byte0),
-                                         fifo.write_en.eq(1),
-                                         wordsreceived.eq(wordsreceived+1),
-                                         fifo.write_data.eq(
-                                             interf.word_received)]
-                            m.next = 'WRITE'
-                        with m.Else():
-                            m.d.sync += error.eq(1)
-                            m.next = 'WAIT_COMMAND'
-                    with m.Else():
-                        m.d.sync += [fifo.write_en.eq(1),
-                                     wordsreceived.eq(wordsreceived+1),
-                                     fifo.write_data.eq(interf.word_received)]
-                        m.next = 'WRITE'
-            with m.State('WRITE'):
-                m.d.sync += fifo.write_en.eq(0)
-                wordslaser = wordsinscanline(
-                    params(platform)['BITSINSCANLINE'])
-                wordsmotor = wordsinmove(platform.motors)
-                with m.If(((instruction == INSTRUCTIONS.MOVE) &
-                          (wordsreceived >= wordsmotor))
-                          | (instruction == INSTRUCTIONS.WRITEPIN)
-                          | (instruction == INSTRUCTIONS.LASTSCANLINE)
-                          | ((instruction == INSTRUCTIONS.SCANLINE) &
-                          (wordsreceived >= wordslaser)
-                          )):
-                    m.d.sync += [wordsreceived.eq(0),
-                                 fifo.write_commit.eq(1)]
-                    m.next = 'COMMIT'
-                with m.Else():
-                    m.next = 'WAIT_COMMAND'
-            with m.State('COMMIT'):
-                m.d.sync += fifo.write_commit.eq(0)
-                m.next = 'WAIT_COMMAND'
+                        with parser.If(mtrcntr < platform.motors-1):
+                            parser.d.sync += mtrcntr.eq(mtrcntr+1)
+                        with parser.Else():
+                            parser.d.sync += mtrcntr.eq(0)
+            with parser.State('WAIT_WORD'):
+                with parser.If(interf.word_complete):
+                    parser.d.comb += word_valid.eq(1)
+                    # next word of burst replies with current state
+                    with parser.If(remaining != 0):
+                        parser.d.sync += [remaining.eq(remaining-1),
+                                          interf.word_to_send.eq(
+                                          status_reply)]
+                    with parser.Else():
+                        parser.next = 'WAIT_COMMAND'
+                with parser.Elif(~self.spi.cs):
+                    parser.d.comb += abort.eq(1)
+                    parser.d.sync += remaining.eq(0)
+                    parser.next = 'WAIT_COMMAND'
+        m.submodules.parser = DomainRenamer(self.domain)(parser)
         return m
 
 
@@ -202,7 +526,8 @@ class Dispatcher(Elaboratable):
     def elaborate(self, platform):
         m = Module()
         # Parser
-        parser = SPIParser(self.platform)
+        domain = self.platform.spi_domain
+        parser = SPIParser(self.platform, domain=domain)
         m.submodules.parser = parser
         # Busy used to detect move or scanline in action
         # disabled "dispatching"
@@ -212,7 +537,7 @@ class Dispatcher(Elaboratable):
         m.submodules.polynomal = polynomal
         if platform:
             board_spi = platform.request("debug_spi")
-            spi = synchronize(m, board_spi)
+            spi = synchronize(m, board_spi, o_domain=domain)
             m.submodules.car = platform.clock_domain_generator()
             laserheadpins = platform.request("laserscanner")
             steppers = [res for res in get_all_resources(platform, "stepper")]
@@ -222,7 +547,7 @@ class Dispatcher(Elaboratable):
             self.spi = SPIBus()
             self.parser = parser
             self.pol = polynomal
-            spi = synchronize(m, self.spi)
+            spi = synchronize(m, self.spi, o_domain=domain)
             self.laserheadpins = platform.laserhead
             self.steppers = steppers = platform.steppers
             self.busy = busy
@@ -248,9 +573,24 @@ class Dispatcher(Elaboratable):
         if platform.name == 'Test':
             self.laserhead = laserhead
         # position adder
+        #   positions are stored in memory, after a move
+        #   they are updated one motor at a time
         busy_d = Signal()
         m.d.sync += busy_d.eq(polynomal.busy)
+        pos_rd = parser.position.read_port(transparent=False)
+        pos_wr = parser.position.write_port()
+        m.submodules.pos_rd = pos_rd
+        m.submodules.pos_wr = pos_wr
+        pos_motor = Signal(range(platform.motors))
+        pos_idle = Signal()
+        m.d.comb += [pos_rd.addr.eq(pos_motor),
+                     pos_wr.addr.eq(pos_motor),
+                     pos_wr.data.eq(pos_rd.data
+                                    + polynomal.totalsteps[pos_motor])]
         coeffcnt = Signal(range(len(polynomal.coeff)))
+        # head of instruction is registered before it is decoded
+        opcode = Signal(8)
+        payload = Signal(MEMWIDTH-8)
         # connect laserhead
         m.d.comb += [
             laserheadpins.pwm.eq(laserhead.pwm),
@@ -290,9 +630,25 @@ class Dispatcher(Elaboratable):
         m.d.comb += busy.eq(polynomal.busy | laserhead.process_lines)
         # connect spi
         m.d.comb += parser.spi.connect(spi)
-        with m.If((busy_d == 1) & (busy == 0)):
-            for idx, position in enumerate(parser.position):
-                m.d.sync += position.eq(position+polynomal.totalsteps[idx])
+        with m.FSM(reset='WAIT_MOVE', name='position'):
+            # idle is cleared in the cycle the update is triggered
+            with m.State('WAIT_MOVE'):
+                with m.If((busy_d == 1) & (busy == 0)):
+                    m.d.sync += pos_motor.eq(0)
+                    m.next = 'READ'
+                with m.Else():
+                    m.d.comb += pos_idle.eq(1)
+            # read of position takes a cycle
+            with m.State('READ'):
+                m.d.sync += pos_wr.en.eq(1)
+                m.next = 'WRITE'
+            with m.State('WRITE'):
+                m.d.sync += pos_wr.en.eq(0)
+                with m.If(pos_motor == platform.motors-1):
+                    m.next = 'WAIT_MOVE'
+                with m.Else():
+                    m.d.sync += pos_motor.eq(pos_motor+1)
+                    m.next = 'READ'
         # pins you can write to
         pins = Cat(lasers, enable_prism, laserhead.synchronize)
         with m.FSM(reset='RESET', name='dispatcher'):
@@ -301,43 +657,48 @@ class Dispatcher(Elaboratable):
                 m.d.sync += pins.eq(0)
             with m.State('WAIT_INSTRUCTION'):
                 m.d.sync += [self.read_commit.eq(0), polynomal.start.eq(0)]
-                with m.If((self.empty == 0) & parser.execute & (busy == 0)):
+                with m.If((self.empty == 0) & parser.execute & (busy == 0)
+                          & pos_idle):
                     m.d.sync += self.read_en.eq(1)
-                    m.next = 'PARSEHEAD'
+                    m.next = 'READHEAD'
+            with m.State('READHEAD'):
+                m.d.sync += [self.read_en.eq(0),
+                             opcode.eq(self.read_data[:8]),
+                             payload.eq(self.read_data[8:])]
+                m.next = 'PARSEHEAD'
             # check which instruction we r handling
             with m.State('PARSEHEAD'):
-                byte0 = self.read_data[:8]
-                m.d.sync += self.read_en.eq(0)
-                with m.If(byte0 == INSTRUCTIONS.MOVE):
-                    m.d.sync += [polynomal.ticklimit.eq(self.read_data[8:]),
-                                 coeffcnt.eq(0)]
-                    m.next = 'MOVE_POLYNOMAL'
-                with m.Elif(byte0 == INSTRUCTIONS.WRITEPIN):
-                    m.d.sync += [pins.eq(self.read_data[8:]),
-                                 self.read_commit.eq(1)]
-                    m.next = 'WAIT'
-                with m.Elif((byte0 == INSTRUCTIONS.SCANLINE) |
-                            (byte0 == INSTRUCTIONS.LASTSCANLINE)):
-                    m.d.sync += [self.read_discard.eq(1),
-                                 laserhead.synchronize.eq(1),
-                                 laserhead.expose_start.eq(1)]
-                    m.next = 'SCANLINE'
-                with m.Else():
-                    m.next = 'ERROR'
-                    m.d.sync += parser.dispatcherror.eq(1)
+                with m.Switch(opcode):
+                    with m.Case(INSTRUCTIONS.MOVE):
+                        m.d.sync += [polynomal.ticklimit.eq(payload),
+                                     coeffcnt.eq(0),
+                                     self.read_en.eq(1)]
+                        m.next = 'MOVE_POLYNOMAL'
+                    with m.Case(INSTRUCTIONS.WRITEPIN):
+                        m.d.sync += [pins.eq(payload),
+                                     self.read_commit.eq(1)]
+                        m.next = 'WAIT'
+                    with m.Case(INSTRUCTIONS.SCANLINE,
+                                INSTRUCTIONS.LASTSCANLINE):
+                        m.d.sync += [self.read_discard.eq(1),
+                                     laserhead.synchronize.eq(1),
+                                     laserhead.expose_start.eq(1)]
+                        m.next = 'SCANLINE'
+                    with m.Default():
+                        m.next = 'ERROR'
+                        m.d.sync += parser.dispatcherror.eq(1)
+            # read is kept enabled, a coefficient is loaded every cycle
+            #   coefficients are shifted in to avoid a demultiplexer
             with m.State('MOVE_POLYNOMAL'):
-                with m.If(coeffcnt < len(polynomal.coeff)):
-                    with m.If(self.read_en == 0):
-                        m.d.sync += self.read_en.eq(1)
-                    with m.Else():
-                        m.d.sync += [polynomal.coeff[coeffcnt].eq(
-                                     self.read_data),
-                                     coeffcnt.eq(coeffcnt+1),
-                                     self.read_en.eq(0)]
-                with m.Else():
+                m.d.sync += Cat(*polynomal.coeff).eq(
+                            Cat(*polynomal.coeff[1:], self.read_data))
+                with m.If(coeffcnt == len(polynomal.coeff)-1):
                     m.next = 'WAIT'
-                    m.d.sync += [polynomal.start.eq(1),
+                    m.d.sync += [self.read_en.eq(0),
+                                 polynomal.start.eq(1),
                                  self.read_commit.eq(1)]
+                with m.Else():
+                    m.d.sync += coeffcnt.eq(coeffcnt+1)
             with m.State('SCANLINE'):
                 m.d.sync += [self.read_discard.eq(0),
                              laserhead.expose_start.eq(0)]
@@ -353,19 +714,75 @@ class Dispatcher(Elaboratable):
         return m
 
 
-class TestParser(SPIGatewareTestCase):
-    platform = TestPlatform()
-    FRAGMENT_UNDER_TEST = SPIParser
-    FRAGMENT_ARGUMENTS = {'platform': platform}
+def wait_for(signal, value=1, timeout=100):
+    '''waits till signal has value
+
+    signal   -- signal to wait for
+    value    -- value to wait for
+    timeout  -- max number of cycles to wait
+    '''
+    for _ in range(timeout):
+        if (yield signal) == value:
+            return
+        yield
+    raise TimeoutError(f"{signal.name} not {value} after {timeout} cycles")
+
 
+def count_cycles(process):
+    '''runs simulation process and counts the clock cycles it takes
+
+    returns value of process and number of cycles
+    '''
+    cycles = 0
+    response = None
+    try:
+        while True:
+            command = process.send(response)
+            if command is None:
+                cycles += 1
+            response = yield command
+    except StopIteration as stop:
+        return stop.value, cycles
+
+
+class HostMixin:
+    '''host communicates with device under test via simulated spi bus'''
     def initialize_signals(self):
         self.host = Host(self.platform)
         self.host.spi_exchange_data = self.spi_exchange_data
         yield self.dut.spi.cs.eq(0)
 
+
+class SPIDomainMixin:
+    '''runs the spi interface in a separate clock domain
+
+    Chip select is held low for cs_gap cycles of the spi
+    domain before each transaction.
+    '''
+    # spi clock frequency over sync clock frequency, 2 as on Firestarter
+    spi_ratio = 2
+    cs_gap = 4
+
+    def setUp(self):
+        super().setUp()
+        self.sim.add_clock(1/(self.spi_ratio*self.SYNC_CLOCK_FREQUENCY),
+                           domain='spi')
+
+    def spi_exchange_data(self, data, msb_first=True):
+        yield self.dut.spi.cs.eq(0)
+        yield from self.advance_cycles(int(np.ceil(self.cs_gap /
+                                                   self.spi_ratio)))
+        return (yield from super().spi_exchange_data(data, msb_first))
+
+
+class TestParser(HostMixin, SPIGatewareTestCase):
+    platform = TestPlatform()
+    FRAGMENT_UNDER_TEST = SPIParser
+    FRAGMENT_ARGUMENTS = {'platform': platform}
+
     def instruction_ready(self, check):
-        while (yield self.dut.empty) == 1:
-            yield
+        '''waits till instruction is ready and verifies its length'''
+        yield from wait_for(self.dut.empty, 0)
         # Instruction ready
         self.assertEqual((yield self.dut.empty), 0)
         self.assertEqual((yield self.dut.fifo.space_available),
@@ -375,8 +792,8 @@ class TestParser(SPIGatewareTestCase):
     def test_getposition(self):
         decimals = 3
         position = [randint(-2000, 2000) for _ in range(self.platform.motors)]
-        for idx, pos in enumerate(self.dut.position):
-            yield pos.eq(position[idx])
+        for idx, pos in enumerate(position):
+            yield self.dut.position[idx].eq(pos)
         lst = (yield from self.host.position).round(decimals)
         stepspermm = np.array(list(self.platform.stepspermm.values()))
         assert_array_equal(lst, (position/stepspermm).round(decimals))
@@ -386,8 +803,6 @@ class TestParser(SPIGatewareTestCase):
         host = self.host
         yield from host.writeline([1] *
                                   host.laser_params['BITSINSCANLINE'])
-        while (yield self.dut.empty) == 1:
-            yield
         wordslaser = wordsinscanline(params(self.platform)['BITSINSCANLINE'])
         yield from self.instruction_ready(wordslaser)
 
@@ -405,6 +820,17 @@ class TestParser(SPIGatewareTestCase):
                                          polygon=False)
         yield from self.instruction_ready(1)
 
+    @sync_test_case
+    def test_writemovenoburst(self):
+        'write move instruction without burst and verify FIFO'
+        yield from self.host.send_move([1000],
+                                       [1]*self.platform.motors,
+                                       [2]*self.platform.motors,
+                                       [3]*self.platform.motors,
+                                       burst=False)
+        words = wordsinmove(self.platform.motors)
+        yield from self.instruction_ready(words)
+
     @sync_test_case
     def test_writemoveinstruction(self):
         'write move instruction and verify FIFO is no longer empty'
@@ -416,6 +842,25 @@ class TestParser(SPIGatewareTestCase):
         words = wordsinmove(self.platform.motors)
         yield from self.instruction_ready(words)
 
+    @sync_test_case
+    def test_burstabort(self):
+        '''end burst transaction after first word, verify partial move
+        is dropped and next move is received'''
+        host = self.host
+        motors = self.platform.motors
+        commands = host.move_commands([1000], [1]*motors,
+                                      [2]*motors, [3]*motors)
+        self.assertEqual(len(commands), 1)
+        yield from host.send_command(commands[0][:COMMAND_BYTES+WORD_BYTES])
+        self.assertEqual((yield from host.error), False)
+        self.assertEqual((yield self.dut.empty), 1)
+        self.assertEqual((yield self.dut.fifo.space_available),
+                         self.platform.memdepth)
+        yield from host.send_move([1000], [1]*motors,
+                                  [2]*motors, [3]*motors)
+        yield from self.instruction_ready(wordsinmove(motors))
+        self.assertEqual((yield from host.error), False)
+
     @sync_test_case
     def test_readpinstate(self):
         '''set pins to random state'''
@@ -466,28 +911,107 @@ class TestParser(SPIGatewareTestCase):
         except Memfull:
             pass
         self.assertEqual((yield from self.host.memfull()), True)
+        # burst only writes complete moves
+        words = wordsinmove(platform.motors)
+        self.assertEqual((platform.memdepth -
+                         (yield self.dut.fifo.space_available)) % words, 0)
+
+
+class TestParserDomain(SPIDomainMixin, TestParser):
+    'parser tests with spi interface in faster clock domain'
+    FRAGMENT_ARGUMENTS = {'platform': TestParser.platform, 'domain': 'spi'}
+
+
+class TestParserSlowDomain(TestParserDomain):
+    'parser tests with spi interface in slower clock domain'
+    spi_ratio = 0.5
+
+
+class GroupCommitPlatform(TestPlatform):
+    commit_every = 3
+    # an spi transaction takes more than thousand cycles
+    commit_wait = 4000
+
+
+class TestGroupCommit(HostMixin, SPIGatewareTestCase):
+    platform = GroupCommitPlatform()
+    FRAGMENT_UNDER_TEST = SPIParser
+    FRAGMENT_ARGUMENTS = {'platform': platform}
+
+    def writepin(self):
+        yield from self.host.enable_comp(laser0=True,
+                                         laser1=False,
+                                         polygon=False)
 
+    @sync_test_case
+    def test_group(self):
+        'instructions are committed as group'
+        for _ in range(self.platform.commit_every-1):
+            yield from self.writepin()
+            self.assertEqual((yield self.dut.empty), 1)
+        yield from self.writepin()
+        for _ in range(2):
+            yield
+        self.assertEqual((yield self.dut.empty), 0)
+        self.assertEqual((yield self.dut.fifo.space_available),
+                         self.platform.memdepth
+                         - self.platform.commit_every)
 
-class TestDispatcher(SPIGatewareTestCase):
+    @sync_test_case
+    def test_timeout(self):
+        '''partial group is committed after wait, wait is counted
+           from the first instruction of the group'''
+        platform = self.platform
+        margin = 10
+        yield from self.writepin()
+        # first instruction is written but not committed
+        yield from wait_for(self.dut.fifo.space_available,
+                            platform.memdepth - 1, timeout=margin)
+        self.assertEqual((yield self.dut.empty), 1)
+        _, cycles = yield from count_cycles(self.writepin())
+        yield from self.advance_cycles(platform.commit_wait
+                                       - cycles - margin)
+        self.assertEqual((yield self.dut.empty), 1)
+        yield from self.advance_cycles(2*margin)
+        self.assertEqual((yield self.dut.empty), 0)
+        self.assertEqual((yield self.dut.fifo.space_available),
+                         platform.memdepth - 2)
+
+    @sync_test_case
+    def test_burstabort(self):
+        'aborted burst drops uncommitted group and raises error'
+        host = self.host
+        motors = self.platform.motors
+        yield from self.writepin()
+        commands = host.move_commands([1000], [1]*motors,
+                                      [2]*motors, [3]*motors)
+        yield from host.send_command(commands[0][:COMMAND_BYTES+WORD_BYTES])
+        self.assertEqual((yield from host.error), True)
+        self.assertEqual((yield self.dut.fifo.space_available),
+                         self.platform.memdepth)
+
+
+class TestDispatcher(HostMixin, SPIGatewareTestCase):
     platform = TestPlatform()
     FRAGMENT_UNDER_TEST = Dispatcher
-    FRAGMENT_ARGUMENTS = {'platform': platform, 'divider': 1,
+    FRAGMENT_ARGUMENTS = {'platform': platform, 'divider': 2,
                           'simdiode': True}
 
-    def initialize_signals(self):
-        self.host = Host(self.platform)
-        self.host.spi_exchange_data = self.spi_exchange_data
-        yield self.dut.spi.cs.eq(0)
+    def wait_complete(self, timeout=100_000):
+        '''helper method to wait for completion
 
-    def wait_complete(self):
-        '''helper method to wait for completion'''
+        timeout  -- max number of cycles to wait
+        '''
         cntr = 0
-        while (yield self.dut.busy) or (cntr < 100):
+        for _ in range(timeout):
+            if not ((yield self.dut.busy) or (cntr < 100)):
+                return
             if (yield self.dut.pol.busy):
                 cntr = 0
             else:
                 cntr += 1
             yield
+        raise TimeoutError(f"Not completed after {timeout} cycles")
 
     @sync_test_case
     def test_memfull(self):
@@ -511,8 +1035,7 @@ class TestDispatcher(SPIGatewareTestCase):
         self.assertEqual((yield from self.host.memfull()), True)
         yield from self.host._executionsetter(True)
         # data should now be processed from sram and empty become 1
-        while (yield self.dut.parser.empty) == 0:
-            yield
+        yield from wait_for(self.dut.parser.empty, timeout=10_000)
         # 2 clocks needed for error to propagate
         yield
         yield
@@ -549,8 +1072,7 @@ class TestDispatcher(SPIGatewareTestCase):
                                          laser1=False,
                                          polygon=False)
         # wait till instruction is received
-        while (yield self.dut.parser.empty):
-            yield
+        yield from wait_for(self.dut.parser.empty, 0)
         yield
         self.assertEqual((yield from self.host.error), False)
         self.assertEqual((yield self.dut.laserheadpins.laser0), 1)
@@ -583,8 +1105,7 @@ class TestDispatcher(SPIGatewareTestCase):
         yield from self.pulse(fifo.write_commit)
         self.assertEqual((yield self.dut.parser.empty), 0)
         # data should now be processed from sram and empty become 1
-        while (yield self.dut.parser.empty) == 0:
-            yield
+        yield from wait_for(self.dut.parser.empty, timeout=10_000)
         # 2 clocks needed for error to propagate
         yield
         yield
@@ -621,11 +1142,9 @@ class TestDispatcher(SPIGatewareTestCase):
                                        b,
                                        c)
         # wait till instruction is received
-        while (yield self.dut.pol.start) == 0:
-            yield
+        yield from wait_for(self.dut.pol.start, timeout=1_000)
         yield
-        while (yield self.dut.pol.busy):
-            yield
+        yield from wait_for(self.dut.pol.busy, 0, timeout=100_000)
         # confirm receipt tick limit and coefficients
         self.assertEqual((yield self.dut.pol.ticklimit), 10_000)
         coefficients = [a, b, c]
@@ -634,8 +1153,7 @@ class TestDispatcher(SPIGatewareTestCase):
                 indx = motor*(DEGREE)+coef
                 self.assertEqual((yield self.dut.pol.coeff[indx]),
                                  coefficients[coef][motor])
-        while (yield self.dut.pol.busy):
-            yield
+        yield from wait_for(self.dut.pol.busy, 0, timeout=100_000)
         for motor in range(self.platform.motors):
             self.assertEqual((yield self.dut.pol.cntrs[motor*DEGREE]),
                              a[motor]*ticks + b[motor]*pow(ticks, 2)
@@ -652,13 +1170,28 @@ class TestDispatcher(SPIGatewareTestCase):
         self.assertEqual((yield from self.host.pinstate)['synchronized'],
                          True)
         yield from self.host.enable_comp(synchronize=False)
-        while (yield self.dut.parser.empty) == 0:
-            yield
+        yield from wait_for(self.dut.parser.empty, timeout=10_000)
         self.assertEqual((yield from self.host.pinstate)['synchronized'],
                          False)
         self.assertEqual((yield from self.host.error), False)
 
 
+class DomainPlatform(TestPlatform):
+    spi_domain = 'spi'
+
+
+class TestDispatcherDomain(SPIDomainMixin, TestDispatcher):
+    'dispatcher tests with spi interface in faster clock domain'
+    platform = DomainPlatform()
+    FRAGMENT_ARGUMENTS = {'platform': platform, 'divider': 2,
+                          'simdiode': True}
+
+
+class TestDispatcherSlowDomain(TestDispatcherDomain):
+    'dispatcher tests with spi interface in slower clock domain'
+    spi_ratio = 0.5
+
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -676,9 +1209,6 @@ if __name__ == "__main__":
 #   -- test execution speed to ensure the right PLL is propagated
 #   -- use CRC packet for tranmission failure (it is in litex but not luna)
 #   -- try to replace value == 0 with ~value
-#   -- xfer3 is faster in transaction
-#   -- if you chip select is released parsers should return to initial state
-#      now you get an error if you abort the transaction
 #   -- number of ticks per motor is uniform
 #   -- yosys does not give an error if you try to synthesize invalid memory
 #   -- read / write commit is not perfect
@@ -27,18 +27,23 @@ class Polynomal(Elaboratable):
         O: busy           -- busy signal
         O: finished       -- finished signal
         O: total steps    -- total steps executed in move
-        O: dir            -- direction; 1 is postive and 0 is negative
-        O: step           -- step signal
+        O: dir            -- direction per motor bit; 1 is postive
+                             and 0 is negative
+        O: step           -- step signal per motor bit
     """
     def __init__(self, platform=None, divider=50, top=False):
         '''
             platform  -- pass test platform
             divider -- original clock of 100 MHz via PLL reduced to 50 MHz
                        if this is divided by 50 motor state updated
-                       with 1 Mhz
+                       with 1 Mhz, must be at least the number
+                       of motors and 2 as motors are updated one by
+                       one in a pipeline
             top       -- trigger synthesis of module
         '''
         self.top = top
+        # motors are updated one at a time in between ticks
+        assert divider >= max(platform.motors, 2)
         self.divider = divider
         self.platform = platform
         self.order = DEGREE
@@ -46,8 +51,18 @@ class Polynomal(Elaboratable):
         assert self.order == 3
         self.motors = platform.motors
         self.max_steps = int(MOVE_TICKS/2)  # Nyquist
+        # integrator is a linear system, per motor the counters
+        # are updated in a tick as cntrs = A*cntrs + B*coeff
+        self.A = [[1, 1, 1],
+                  [0, 1, 1],
+                  [0, 0, 1]]
+        self.B = [[1, 1, 1],
+                  [0, 2, 0],
+                  [0, 0, 6]]
         # inputs
-        self.coeff = Array()
+        #   signals are only indexed with constants, lists or
+        #   signal slices avoid the multiplexers of an array
+        self.coeff = []
         for _ in range(self.motors):
             self.coeff.extend([Signal(signed(64)),
                                Signal(signed(64)),
@@ -56,19 +71,25 @@ class Polynomal(Elaboratable):
         self.ticklimit = Signal(MOVE_TICKS.bit_length())
         # output
         self.busy = Signal()
+        # position update indexes the total steps with a signal
         self.totalsteps = Array(Signal(signed(self.max_steps.bit_length()+1))
                                 for _ in range(self.motors))
-        self.dir = Array(Signal() for _ in range(self.motors))
-        self.step = Array(Signal() for _ in range(self.motors))
+        self.dir = Signal(self.motors)
+        self.step = Signal(self.motors)
 
     def elaborate(self, platform):
         m = Module()
         # add 1 MHZ clock domain
-        cntr = Signal(range(self.divider))
+        #   down counter, tick is given at terminal count
+        cntr = Signal(range(self.divider), reset=self.divider-1)
+        tick_tc = Signal()
+        m.d.comb += tick_tc.eq(cntr == 0)
+        # ticks limit is reached, updated in advance at a tick
+        ticks_done = Signal()
         # pos
         max_bits = (self.max_steps << BIT_SHIFT).bit_length()
-        cntrs = Array(Signal(signed(max_bits+1))
-                      for _ in range(len(self.coeff)))
+        cntrs = [Signal(signed(max_bits+1))
+                 for _ in range(len(self.coeff))]
         assert max_bits <= 64
         ticks = Signal(MOVE_TICKS.bit_length())
         if self.top:
@@ -87,17 +108,69 @@ class Polynomal(Elaboratable):
                          cntrs[motor*self.order][BIT_SHIFT]),
                          self.totalsteps[motor].eq(
                          cntrs[motor*self.order] >> (BIT_SHIFT+1))]
-        # directions
-        counter_d = Array(Signal(signed(max_bits+1))
-                          for _ in range(self.motors))
-        for motor in range(self.motors):
-            m.d.sync += counter_d[motor].eq(cntrs[motor*self.order])
-            # negative case --> decreasing
-            with m.If(counter_d[motor] > cntrs[motor*self.order]):
-                m.d.sync += self.dir[motor].eq(0)
-            # positive case --> increasing
-            with m.Elif(counter_d[motor] < cntrs[motor*self.order]):
-                m.d.sync += self.dir[motor].eq(1)
+        # products of the counters and coefficients with their matrix
+        #   counters only change in a tick, coefficient sums are
+        #   registered for all motors
+        #   registers are enabled explicitly, i.e. coefficients are only
+        #   loaded if idle and the counters are only summed in a walk
+
+        def matvec(row, vector):
+            return sum(val*vec if val != 1 else vec
+                       for val, vec in zip(row, vector) if val != 0)
+        coeff_sum = [Signal(signed(max_bits+1))
+                     for _ in range(len(self.coeff))]
+        with m.If(~self.busy):
+            for motor in range(self.motors):
+                idx = motor*self.order
+                coeff = self.coeff[idx:idx+self.order]
+                for lane in range(self.order):
+                    m.d.sync += coeff_sum[idx+lane].eq(
+                                matvec(self.B[lane], coeff))
+        # counter update is shared by the motors
+        #   after a tick the motors are walked, in the first stage
+        #   the counters of a motor are selected and summed, in the
+        #   second stage the result is written back, a walk can
+        #   start in the last cycle of the previous walk
+
+        def lanes(signals, lane):
+            return Array(signals[motor*self.order+lane]
+                         for motor in range(self.motors))
+        mtr = Signal(range(self.motors))
+        mtr_d = Signal.like(mtr)
+        walk = Signal()
+        write = Signal()
+        m.d.sync += [mtr_d.eq(mtr), write.eq(walk)]
+        state = [lanes(cntrs, lane)[mtr] for lane in range(self.order)]
+        # position, position increment in a tick and sums of other lanes
+        pos = Signal(signed(max_bits+1))
+        delta = Signal(signed(max_bits+1))
+        cntrs_sum = [Signal(signed(max_bits+1))
+                     for _ in range(self.order)]
+        with m.If(walk):
+            with m.If(mtr == self.motors-1):
+                m.d.sync += [mtr.eq(0), walk.eq(0)]
+            with m.Else():
+                m.d.sync += mtr.eq(mtr+1)
+            m.d.sync += [pos.eq(state[0]),
+                         delta.eq(matvec(self.A[0][1:], state[1:])
+                                  + lanes(coeff_sum, 0)[mtr])]
+            for lane in range(1, self.order):
+                m.d.sync += cntrs_sum[lane].eq(matvec(self.A[lane],
+                                                      state))
+        update = [pos+delta]
+        for lane in range(1, self.order):
+            update.append(cntrs_sum[lane]+lanes(coeff_sum, lane)[mtr_d])
+        with m.If(write):
+            for motor in range(self.motors):
+                with m.If(mtr_d == motor):
+                    idx = motor*self.order
+                    for lane in range(self.order):
+                        m.d.sync += cntrs[idx+lane].eq(update[lane])
+                    # direction is kept if position does not change
+                    with m.If(delta < 0):
+                        m.d.sync += self.dir[motor].eq(0)
+                    with m.Elif(delta > 0):
+                        m.d.sync += self.dir[motor].eq(1)
         with m.FSM(reset='RESET', name='polynomen'):
             with m.State('RESET'):
                 m.next = 'WAIT_START'
@@ -109,28 +182,21 @@ class Polynomal(Elaboratable):
                         coef0 = motor*self.order
                         m.d.sync += [cntrs[coef0+2].eq(0),
                                      cntrs[coef0+1].eq(0),
-                                     cntrs[coef0].eq(0),
-                                     counter_d[motor].eq(0)]
-                    m.d.sync += self.busy.eq(1)
+                                     cntrs[coef0].eq(0)]
+                    m.d.sync += [self.busy.eq(1),
+                                 cntr.eq(self.divider-1),
+                                 ticks_done.eq(self.ticklimit == 0)]
                     m.next = 'RUNNING'
             with m.State('RUNNING'):
-                with m.If((ticks < self.ticklimit) & (cntr >= self.divider-1)):
+                with m.If(~ticks_done & tick_tc):
                     m.d.sync += [ticks.eq(ticks+1),
-                                 cntr.eq(0)]
-                    for motor in range(self.motors):
-                        idx = motor*self.order
-                        op3 = 3*2*self.coeff[idx+2] + cntrs[idx+2]
-                        op2 = (cntrs[idx+2] + 2*self.coeff[idx+1]
-                               + cntrs[idx+1])
-                        op1 = (self.coeff[idx+2] + self.coeff[idx+1]
-                               + self.coeff[idx] + cntrs[idx+2] +
-                               cntrs[idx+1] + cntrs[idx])
-                        m.d.sync += [cntrs[idx+2].eq(op3),
-                                     cntrs[idx+1].eq(op2),
-                                     cntrs[idx].eq(op1)]
-                with m.Elif(ticks < self.ticklimit):
-                    m.d.sync += cntr.eq(cntr+1)
-                with m.Else():
+                                 ticks_done.eq(ticks+1 >= self.ticklimit),
+                                 cntr.eq(self.divider-1),
+                                 walk.eq(1)]
+                with m.Elif(~ticks_done):
+                    m.d.sync += cntr.eq(cntr-1)
+                # last update is written back
+                with m.Elif(~walk & ~write):
                     m.d.sync += ticks.eq(0)
                     m.next = 'WAIT_START'
         return m
@@ -139,7 +205,7 @@ class Polynomal(Elaboratable):
 class TestPolynomal(LunaGatewareTestCase):
     platform = TestPlatform()
     FRAGMENT_UNDER_TEST = Polynomal
-    FRAGMENT_ARGUMENTS = {'platform': platform, 'divider': 1}
+    FRAGMENT_ARGUMENTS = {'platform': platform, 'divider': 2}
 
     def initialize_signals(self):
         self.host = Host(self.platform)
@@ -5,17 +5,24 @@ import numpy as np
 #       for cross scan error etc
 
 
+def grayscale(img):
+    '''converts BGR image to gray, gray images are returned as is'''
+    if img.ndim == 3:
+        return cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+    return img
+
+
 def find_largestcontour(img, denoise=False):
     '''finds the contours in the image
 
-    img      --  numpy array to find contours in
+    img      --  numpy array to find contours in, BGR or gray
     denoise  --  larger than 0 image gets denoised for erode
                  and dilate operation
 
     returns contour with largest area
     '''
     # RGB image to gray
-    imgray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+    imgray = grayscale(img)
     # Converts gray scale image to binary using a threshold
     _, thresh = cv.threshold(imgray, img.max()//2, 255, cv.THRESH_BINARY)
     if denoise:
@@ -92,6 +99,25 @@ def detect_line(img, debug=False, fname='detectlinedebug.jpg'):
     return line
 
 
+def detect_line_from_points(points):
+    '''fit line through point cloud
+
+    The idea is that the motor and laser are turned on.
+    A line is generated. Instead of the image, the coordinates
+    of the pixels above a threshold are passed, e.g.
+    ys, xs = np.nonzero(gray > thresh).
+    No contour is searched, so speckles above the threshold are
+    part of the points. A robust distance keeps them from pulling
+    the fit, the line agrees with detect_line. The returned point
+    lies on this line but differs from the one of detect_line.
+
+    points  -- float32 array of shape (N, 2) with x, y coordinates
+
+    returns [vx, vy, x, y]
+    '''
+    return cv.fitLine(points, cv.DIST_HUBER, 0, 0.01, 0.01).ravel()
+
+
 def cross_scan_error(img, pixelsize=3, debug=False,
                      fname='crossscanndebug.jpg'):
     '''detect line and determine cross scan error
@@ -108,7 +134,7 @@ def cross_scan_error(img, pixelsize=3, debug=False,
     # image is denoised to ensure one skeleton is detected
     c = find_largestcontour(img, denoise=8)
     # RGB image to gray
-    imgray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+    imgray = grayscale(img)
     # Converts gray scale image to binary using a threshold
     _, thresh = cv.threshold(imgray, img.max()//2, 255, cv.THRESH_BINARY)
     # extract contour
@@ -28,6 +28,9 @@ class TestPlatform:
                  'SINGLE_FACET': False, 'DIRECTION': 0}
     motors = len(stepspermm.keys())
     memdepth = wordsinmove(motors)*2+1
+    commit_every = 1   # instructions per FIFO commit
+    commit_wait = 1    # cycles before a partial group is committed
+    spi_domain = 'sync'  # clock domain of spi interface and parser
     steppers = [StepperRecord()]*motors
     laserhead = LaserscannerRecord()
 
@@ -99,43 +102,49 @@ class FirestarterDomainGenerator(Elaboratable):
 
         # Create our domains...
         m.domains.sync = ClockDomain()
+        m.domains.spi = ClockDomain()
         m.domains.pol = ClockDomain()
 
-        # clocks 50 MHz circuit
-        #         1 MHz update frequency motor
+        # clocks 100 MHz spi interface and parser
+        #         50 MHz circuit
+        #          1 MHz update frequency motor
+        clk100 = Signal()
         clk50 = Signal()
         # clk1 = Signal()
         # details see iCE40 sysCLOCK PLL Design and Usage
-        # settings comment out are for SB_PLL40_2F_CORE
         m.submodules.pll = \
-            Instance("SB_PLL40_CORE",
+            Instance("SB_PLL40_2F_CORE",
                      i_REFERENCECLK=platform.request(platform.default_clk),
                      i_RESETB=Const(1),
-                     # i_BYPASS=Const(0),
-                     o_PLLOUTGLOBAL=clk50,
+                     i_BYPASS=Const(0),
+                     o_PLLOUTGLOBALA=clk50,
+                     o_PLLOUTGLOBALB=clk100,
                      o_LOCK=locked,
-                     # Create a 50 MHz PLL clock...
+                     # Create a 100 MHz PLL clock...
                      p_FEEDBACK_PATH="SIMPLE",
-                     # internally generated PLL
-                     # p_PLLOUT_SELECT_PORTA="GENCLK",
-                     # p_PLLOUT_SELECT_PORTB="SHIFTREG_0deg",
+                     # ... and a 50 MHz clock at half the frequency
+                     p_PLLOUT_SELECT_PORTA="GENCLK_HALF",
+                     p_PLLOUT_SELECT_PORTB="GENCLK",
                      p_DIVR=0,
                      p_DIVF=7,
-                     p_DIVQ=4,
+                     p_DIVQ=3,
                      p_FILTER_RANGE=5,
                      )
 
         # ... and constrain them to their new frequencies.
         platform.add_clock_constraint(clk50, 50e6)
+        platform.add_clock_constraint(clk100, 100e6)
         # platform.add_clock_constraint(clk1, 1e6)
 
         # We'll use our 50MHz clock for everything _except_ the polynomal
-        # which create ticks for the motors
+        # which create ticks for the motors and the spi interface
         m.d.comb += [
             # ClockSignal("pol").eq(clk1),
             ClockSignal("sync").eq(clk50),
+            ClockSignal("spi").eq(clk100),
             # ResetSignal("pol").eq(~locked),
             ResetSignal("sync").eq(~locked),
+            ResetSignal("spi").eq(~locked),
         ]
 
         return m
@@ -160,6 +169,9 @@ class Firestarter(LatticeICE40Platform):
                  'SINGLE_FACET': False, 'DIRECTION': 0}
     motors = len(stepspermm.keys())
     memdepth = 256
+    commit_every = 4   # instructions per FIFO commit
+    commit_wait = 500  # cycles before a partial group is committed
+    spi_domain = 'spi'  # clock domain of spi interface and parser
     device = 'iCE40HX4K'
     package = 'TQ144'
     default_clk = 'clk100_mhz'
@@ -1,5 +1,6 @@
 import unittest
 from pathlib import Path
+from functools import lru_cache
 import time
 import os
 
@@ -16,22 +17,46 @@ IMG_DIR = Path(TEST_DIR, 'images')
 TESTIMG_DIR = Path(TEST_DIR, 'testimages')
 
 
+@lru_cache(maxsize=None)
+def _load_gray(name):
+    '''loads test image as grayscale, images are cached
+
+    returned array is shared, do not modify it
+    '''
+    return cv.imread(str(Path(TESTIMG_DIR, name)), cv.IMREAD_GRAYSCALE)
+
+
 class OpticalTest(unittest.TestCase):
     '''Tests algorithms upon earlier taken images'''
 
     def test_laserline(self):
         '''tests laser line detection
         '''
-        img = cv.imread(str(Path(TESTIMG_DIR, 'laserline1.jpg')))
+        img = _load_gray('laserline1.jpg')
         line = [vx, vy, x, y] = feature.detect_line(img)
         res = [0, 0, 1099, 719]
         for idx, val in enumerate(line):
             self.assertEqual(int(val), int(res[idx]))
 
+    def test_laserline_points(self):
+        '''tests laser line detection on pixels above threshold
+           agrees with detection on contour
+        '''
+        img = _load_gray('laserline1.jpg')
+        ys, xs = np.nonzero(img > img.max()//2)
+        points = np.stack([xs, ys], axis=1).astype(np.float32)
+        vx, vy, x, y = feature.detect_line_from_points(points)
+        res_vx, res_vy, res_x, res_y = np.ravel(feature.detect_line(img))
+        self.assertAlmostEqual(vx, res_vx, places=2)
+        self.assertAlmostEqual(vy, res_vy, places=2)
+        # distance of fitted point to contour line in pixels
+        distance = abs((x-res_x)*res_vy - (y-res_y)*res_vx)
+        self.assertLess(distance, 3)
+
     def test_laserwidth(self):
         '''tests laser width detection
         '''
-        img = cv.imread(str(Path(TESTIMG_DIR, 'laserline.jpg')))
+        img = _load_gray('laserline.jpg')
         dct = feature.cross_scan_error(img)
         dct2 = {'max': 86.36, 'min': 21.58, 'mean': 38.04, 'median': 36.0}
         for k, v in dct.items():
@@ -43,7 +68,7 @@ class OpticalTest(unittest.TestCase):
         dct = {'laserspot1.jpg': np.array([26, 36]),
                'laserspot2.jpg': np.array([27, 41])}
         for k, v in dct.items():
-            img = cv.imread(str(Path(TESTIMG_DIR, k)))
+            img = _load_gray(k)
             np.testing.assert_array_equal(
                 feature.spotsize(img)['axes'].round(0), v)
 
@@ -145,15 +170,18 @@ class Tests(unittest.TestCase):
         yield from self.host.enable_comp(synchronize=False)
 
     def takepicture(self):
-        'takes picture and store it with timestamp to this folder'
+        '''takes picture and store it with timestamp to this folder
+
+        returns grayscale image, stored as lossless png
+        '''
         img = self.cam.capture()
         grey_img = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
         date_string = time.strftime("%Y-%m-%d-%H:%M")
-        print(f"Writing to {Path(IMG_DIR, date_string+'.jpg')}")
+        print(f"Writing to {Path(IMG_DIR, date_string+'.png')}")
         if not os.path.exists(IMG_DIR):
             os.makedirs(IMG_DIR)
-        cv.imwrite(str(Path(IMG_DIR, date_string+'.jpg')), grey_img)
-        return img
+        cv.imwrite(str(Path(IMG_DIR, date_string+'.png')), grey_img)
+        return grey_img
 
 
 if __name__ == '__main__':